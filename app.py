@@ -3,6 +3,8 @@ import pandas as pd
 import plotly.express as px
 from datetime import datetime, timedelta, date
 import time
+import math
+import copy
 
 # --- FIREBASE SETUP ---
 import firebase_admin
@@ -149,6 +151,16 @@ def get_doc(collection_name, doc_id):
         return d
     return None
 
+@st.cache_data(ttl=60, show_spinner=False)
+def carregar_pendentes_por_produto():
+    """Quantidade reservada (pedidos Pendentes) por produto_final_id."""
+    pendentes = {}
+    for d in db.collection('vendas').where('status', '==', 'Pendente').stream():
+        v = d.to_dict()
+        pid = v.get('produto_final_id')
+        if pid: pendentes[pid] = pendentes.get(pid, 0) + v.get('quantidade', 0)
+    return pendentes
+
 # ==========================================
 # 🛒 ROTEAMENTO (O QUE MOSTRAR NA TELA)
 # ==========================================
@@ -236,6 +248,7 @@ if modo_visualizacao == "catalogo_cliente":
         update_doc('produtos_finais', item_atualizado['id'], {
             'estoque_pronto': estoque_real - qtd_cliente
         })
+        carregar_pendentes_por_produto.clear()
         
         st.balloons()
         st.success(f"Pedido Realizado com Sucesso! Obrigado, {cli_nome}.")
@@ -299,6 +312,144 @@ def get_month_options():
         months.append(d.strftime("%Y-%m"))
     return sorted(list(set(months)), reverse=True)
 
+# --- PREVISÃO DE DEMANDA (SUAVIZAÇÃO EXPONENCIAL + SAZONALIDADE SEMANAL) ---
+# O estado de cada produto fica em 'previsao_demanda' (doc id = produto_final_id)
+# e é atualizado a cada pedido concluído, sem reprocessar o histórico inteiro.
+ALFA_NIVEL = 0.2
+GAMA_SAZONAL = 0.3
+
+def estado_previsao_vazio():
+    return {
+        'nivel': 0.0,
+        'sazonal': [0.0] * 7,
+        'n_dias': 0,
+        'n_sazonal': [0] * 7,
+        'ultimo_dia': None,
+        'qtd_dia_aberto': 0.0,
+        'semeado': False
+    }
+
+def _absorver_dia(estado, dia, qtd):
+    # No início usa média simples (1/n) até os pesos fixos assumirem
+    w = dia.weekday()
+    alfa = max(ALFA_NIVEL, 1.0 / (estado['n_dias'] + 1))
+    gama = max(GAMA_SAZONAL, 1.0 / (estado['n_sazonal'][w] + 1))
+    s = estado['sazonal'][w]
+    nivel = alfa * (qtd - s) + (1 - alfa) * estado['nivel']
+    estado['sazonal'][w] = gama * (qtd - nivel) + (1 - gama) * s
+    estado['nivel'] = nivel
+    estado['n_dias'] += 1
+    estado['n_sazonal'][w] += 1
+
+def avancar_estado(estado, dia):
+    """Fecha o dia em aberto e os dias sem venda até a véspera de `dia`."""
+    novo = copy.deepcopy(estado)
+    if not novo.get('ultimo_dia'):
+        return novo
+    ultimo = date.fromisoformat(novo['ultimo_dia'])
+    if dia <= ultimo:
+        return novo
+    _absorver_dia(novo, ultimo, novo['qtd_dia_aberto'])
+    d = ultimo + timedelta(days=1)
+    while d < dia:
+        _absorver_dia(novo, d, 0.0)
+        d += timedelta(days=1)
+    novo['ultimo_dia'] = dia.isoformat()
+    novo['qtd_dia_aberto'] = 0.0
+    return novo
+
+def registrar_venda_no_estado(estado, dia, qtd):
+    novo = avancar_estado(estado, dia)
+    if not novo.get('ultimo_dia'):
+        novo['ultimo_dia'] = dia.isoformat()
+    # Venda com data anterior ao dia em aberto entra no dia em aberto
+    novo['qtd_dia_aberto'] += float(qtd)
+    return novo
+
+def prever_demanda(estado, hoje, inicio, dias):
+    """Soma a previsão de `inicio` até `inicio + dias - 1`.
+
+    Só fecha os dias até ontem: as vendas parciais de hoje ficam fora do modelo.
+    """
+    e = avancar_estado(estado, hoje)
+    total = 0.0
+    for i in range(dias):
+        w = (inicio + timedelta(days=i)).weekday()
+        total += max(0.0, e['nivel'] + e['sazonal'][w])
+    return total
+
+def semear_estado(vendas_finalizadas):
+    """Monta o estado de um produto a partir das suas vendas finalizadas."""
+    por_dia = {}
+    for v in vendas_finalizadas:
+        if not v.get('data_finalizacao'): continue
+        dia = date.fromisoformat(str(v['data_finalizacao'])[:10])
+        por_dia[dia] = por_dia.get(dia, 0.0) + float(v.get('quantidade', 0))
+    estado = estado_previsao_vazio()
+    for dia in sorted(por_dia):
+        estado = registrar_venda_no_estado(estado, dia, por_dia[dia])
+    estado['semeado'] = True
+    return estado
+
+@st.cache_data(ttl=600, show_spinner=False)
+def carregar_previsoes():
+    return {d.id: d.to_dict() for d in db.collection('previsao_demanda').stream()}
+
+def _semear_produto_tx(transaction, produto_id):
+    query = db.collection('vendas').where('produto_final_id', '==', produto_id).where('status', '==', 'Finalizado')
+    return semear_estado([d.to_dict() for d in transaction.get(query)])
+
+@firestore.transactional
+def _concluir_pedido_tx(transaction, venda_ref, produto_id, quantidade, dia):
+    venda_snap = venda_ref.get(transaction=transaction)
+    if not venda_snap.exists or venda_snap.get('status') != 'Pendente':
+        return False
+
+    prev_ref = db.collection('previsao_demanda').document(produto_id) if produto_id else None
+    estado = None
+    if prev_ref:
+        prev_snap = prev_ref.get(transaction=transaction)
+        estado = prev_snap.to_dict() if prev_snap.exists else None
+        if not estado or not estado.get('semeado'):
+            # Primeira vez que o produto é tocado: parte do seu próprio histórico
+            estado = _semear_produto_tx(transaction, produto_id)
+
+    transaction.update(venda_ref, {'status': 'Finalizado', 'data_finalizacao': dia.isoformat()})
+    if prev_ref:
+        transaction.set(prev_ref, registrar_venda_no_estado(estado, dia, quantidade))
+    return True
+
+def concluir_pedido(ped):
+    """Finaliza o pedido e atualiza a previsão do produto na mesma transação."""
+    venda_ref = db.collection('vendas').document(ped['id'])
+    ok = _concluir_pedido_tx(db.transaction(), venda_ref, ped.get('produto_final_id'), ped['quantidade'], date.today())
+    carregar_previsoes.clear()
+    carregar_pendentes_por_produto.clear()
+    return ok
+
+@firestore.transactional
+def _reconstruir_produto_tx(transaction, prev_ref):
+    # Lê o doc do estado para disputar o mesmo lock que _concluir_pedido_tx:
+    # um pedido concluído no meio do rebuild nunca é sobrescrito
+    prev_ref.get(transaction=transaction)
+    transaction.set(prev_ref, _semear_produto_tx(transaction, prev_ref.id))
+
+def reconstruir_previsoes(produto_ids):
+    """Refaz o estado de todos os produtos a partir das vendas finalizadas."""
+    ref = db.collection('previsao_demanda')
+    antigos = [doc.id for doc in ref.select([]).stream()]
+    # Grava os novos antes de apagar os órfãos: uma falha no meio nunca zera o modelo
+    for pid in produto_ids:
+        _reconstruir_produto_tx(db.transaction(), ref.document(pid))
+    orfaos = [pid for pid in antigos if pid not in set(produto_ids)]
+    for i in range(0, len(orfaos), 500):
+        batch = db.batch()
+        for pid in orfaos[i:i + 500]:
+            batch.delete(ref.document(pid))
+        batch.commit()
+    carregar_previsoes.clear()
+    return len(produto_ids)
+
 # --- DIALOGS (POPUPS) ---
 @st.dialog("Novo Insumo")
 def popup_novo_insumo():
@@ -345,8 +496,8 @@ st.sidebar.code(link_para_copiar, language="text")
 
 
 # --- ABAS ---
-aba1, aba2, aba3, aba4, aba5 = st.tabs([
-    "📊 Dashboards", "📦 Estoque MP", "🍩 Produtos", "📝 Novo Pedido", "✅ Pedidos Abertos" 
+aba1, aba2, aba3, aba4, aba5, aba6 = st.tabs([
+    "📊 Dashboards", "📦 Estoque MP", "🍩 Produtos", "📝 Novo Pedido", "✅ Pedidos Abertos", "🔮 Planejamento"
 ])
 
 # --- ABA 1: DASHBOARDS ---
@@ -510,10 +661,11 @@ with aba3:
     st.markdown("### 📝 Gerir Produtos (Alterar Preço/Estoque)")
     
     df_pf = load_collection('produtos_finais')
+    df_pf_edit = df_pf.drop(columns=['receita'], errors='ignore')
     
-    if not df_pf.empty:
+    if not df_pf_edit.empty:
         edited_pf = st.data_editor(
-            df_pf, 
+            df_pf_edit, 
             hide_index=True, 
             use_container_width=True, 
             key="edit_pf_table",
@@ -531,9 +683,9 @@ with aba3:
         )
         
         if st.button("💾 Salvar Alterações nos Produtos"):
-            if not df_pf.equals(edited_pf):
+            if not df_pf_edit.equals(edited_pf):
                 for index, row in edited_pf.iterrows():
-                    original_row = df_pf[df_pf['id'] == row['id']].iloc[0]
+                    original_row = df_pf_edit[df_pf_edit['id'] == row['id']].iloc[0]
                     
                     if (row['estoque_pronto'] != original_row['estoque_pronto'] or 
                         row['preco_venda'] != original_row['preco_venda'] or 
@@ -550,6 +702,43 @@ with aba3:
             else:
                 st.info("Nenhuma alteração detectada para salvar.")
 
+    st.divider()
+
+    st.markdown("### 🧾 Ficha Técnica (Insumos por Unidade)")
+
+    df_mp_rec = df_mp
+    if df_pf.empty or df_mp_rec.empty:
+        st.info("Cadastre produtos e insumos para montar as receitas.")
+    else:
+        pf_rec_map = {row['nome']: row for _, row in df_pf.iterrows()}
+        sel_rec = st.selectbox("Produto", list(pf_rec_map.keys()), key="sel_receita")
+        prod_rec = pf_rec_map[sel_rec]
+        receita_atual = prod_rec.get('receita') if isinstance(prod_rec.get('receita'), dict) else {}
+
+        df_receita = pd.DataFrame({
+            'id': df_mp_rec['id'],
+            'Insumo': df_mp_rec['nome'],
+            'Unidade': df_mp_rec['unidade'],
+            'Qtd por Unidade': [float(receita_atual.get(mp_id, 0.0)) for mp_id in df_mp_rec['id']]
+        })
+        edited_rec = st.data_editor(
+            df_receita,
+            key=f"editor_receita_{prod_rec['id']}",
+            hide_index=True,
+            use_container_width=True,
+            disabled=['Insumo', 'Unidade'],
+            column_config={
+                "id": None,
+                "Qtd por Unidade": st.column_config.NumberColumn(min_value=0.0, format="%.3f")
+            }
+        )
+
+        if st.button("💾 Salvar Receita"):
+            nova_receita = {row['id']: float(row['Qtd por Unidade']) for _, row in edited_rec.iterrows() if row['Qtd por Unidade'] > 0}
+            update_doc('produtos_finais', prod_rec['id'], {'receita': nova_receita})
+            st.success(f"Receita de {sel_rec} salva!")
+            st.rerun()
+
 # --- ABA 4: NOVO PEDIDO ---
 with aba4:
     st.subheader("📝 Criar Pedido (Balcão)")
@@ -597,6 +786,7 @@ with aba4:
                     })
                     
                     update_doc('produtos_finais', item['id'], {'estoque_pronto': item['estoque_pronto'] - v_qtd})
+                    carregar_pendentes_por_produto.clear()
                     st.success(f"Pedido para {nome_cli_final} criado!")
                     st.rerun()
                 else: st.error(f"Estoque insuficiente! Disponível: {item['estoque_pronto']}")
@@ -630,14 +820,15 @@ with aba5:
                     c_btn_ok, c_btn_can = st.columns([1, 1])
                     with c_btn_ok:
                         if st.button("Concluir ✅", key=f"ok_{ped['id']}", use_container_width=True):
-                            update_doc('vendas', ped['id'], {'status': 'Finalizado', 'data_finalizacao': date.today().isoformat()})
-                            st.toast("Finalizado!")
+                            if concluir_pedido(ped): st.toast("Finalizado!")
+                            else: st.toast("Pedido já havia sido concluído ou removido.")
                             st.rerun()
                     with c_btn_can:
                         if st.button("Cancelar ❌", key=f"can_{ped['id']}", use_container_width=True):
                             prod = get_doc('produtos_finais', ped['produto_final_id'])
                             if prod: update_doc('produtos_finais', ped['produto_final_id'], {'estoque_pronto': prod['estoque_pronto'] + ped['quantidade']})
                             delete_doc('vendas', ped['id'])
+                            carregar_pendentes_por_produto.clear()
                             st.warning("Cancelado e estornado.")
                             st.rerun()
                     st.write("")
@@ -651,4 +842,114 @@ with aba5:
         df_fin = load_collection('vendas', mes_selecionado)
         if not df_fin.empty:
             df_fin = df_fin[df_fin['status'] == 'Finalizado']
-            st.dataframe(df_fin[['data_finalizacao', 'cliente_nome', 'produto_nome', 'total_venda']], use_container_width=True, hide_index=True)
\ No newline at end of file
+            st.dataframe(df_fin[['data_finalizacao', 'cliente_nome', 'produto_nome', 'total_venda']], use_container_width=True, hide_index=True)
+
+# --- ABA 6: PLANEJAMENTO DE PRODUÇÃO ---
+with aba6:
+    st.subheader("🔮 Planejamento de Produção e Compras")
+    st.caption("Previsão por produto com base nas vendas finalizadas, pela data de conclusão (média exponencial com efeito do dia da semana). "
+               "Pedidos pendentes já saíram do estoque e são descontados da previsão. Atualizada a cada pedido concluído.")
+
+    hoje = date.today()
+    amanha = hoje + timedelta(days=1)
+    c_ini, c_hor = st.columns(2)
+    with c_ini: inicio_plan = st.date_input("Produzir para a partir de", value=amanha, min_value=amanha)
+    with c_hor: horizonte = st.number_input("Planejar para quantos dias?", min_value=1, max_value=30, value=7)
+
+    estados_prev = carregar_previsoes()
+    pendentes_prod = carregar_pendentes_por_produto()
+    df_pf_plan = df_pf
+    df_mp_plan = df_mp
+
+    if df_pf_plan.empty:
+        st.info("Nenhum produto cadastrado.")
+    else:
+        sem_historico = [prod['nome'] for _, prod in df_pf_plan.iterrows()
+                         if not estados_prev.get(prod['id'], {}).get('semeado')]
+        if sem_historico:
+            st.warning(f"Sem previsão calculada para: {', '.join(sem_historico)}. "
+                       "Use o botão abaixo para processar o histórico de vendas (ou aguarde o próximo pedido concluído do produto).")
+
+        linhas_prod = []
+        necessidade_mp = {}
+        for _, prod in df_pf_plan.iterrows():
+            estado = estados_prev.get(prod['id'])
+            previsto = prever_demanda(estado, hoje, inicio_plan, horizonte) if estado else 0.0
+            # Consumo do estoque até o início do plano: o que ainda falta vender hoje + dias intermediários
+            consumo_antes = 0.0
+            if estado:
+                vendido_hoje = estado['qtd_dia_aberto'] if estado.get('ultimo_dia') == hoje.isoformat() else 0.0
+                consumo_antes = max(0.0, prever_demanda(estado, hoje, hoje, 1) - vendido_hoje)
+                consumo_antes += prever_demanda(estado, hoje, amanha, (inicio_plan - amanha).days)
+            # Pendentes já foram reservados do estoque: abatem a demanda para não contar duas vezes
+            pendente = pendentes_prod.get(prod['id'], 0)
+            previsto_liquido = max(0.0, previsto - max(0.0, pendente - consumo_antes))
+            consumo_antes = max(0.0, consumo_antes - pendente)
+            estoque = int(prod['estoque_pronto'])
+            produzir = max(0, math.ceil(round(previsto_liquido - max(0.0, estoque - consumo_antes), 6)))
+            linhas_prod.append({
+                'Produto': prod['nome'],
+                'Previsão': round(previsto, 1),
+                'Estoque Pronto': estoque,
+                'Pendentes': pendente,
+                'Produzir': produzir
+            })
+            receita = prod.get('receita') if isinstance(prod.get('receita'), dict) else {}
+            for mp_id, qtd_unit in receita.items():
+                necessidade_mp[mp_id] = necessidade_mp.get(mp_id, 0.0) + qtd_unit * produzir
+
+        df_plano = pd.DataFrame(linhas_prod).sort_values(by='Produzir', ascending=False)
+
+        linhas_mp = []
+        if not df_mp_plan.empty:
+            for _, mp in df_mp_plan.iterrows():
+                necessario = necessidade_mp.get(mp['id'], 0.0)
+                if necessario <= 0: continue
+                comprar = max(0.0, necessario - mp['estoque_atual'])
+                linhas_mp.append({
+                    'Insumo': mp['nome'],
+                    'Unidade': mp['unidade'],
+                    'Necessário': necessario,
+                    'Em Estoque': mp['estoque_atual'],
+                    'Comprar': comprar,
+                    'Custo Estimado': comprar * mp['custo_compra']
+                })
+        df_compras = pd.DataFrame(linhas_mp)
+        custo_compras = df_compras['Custo Estimado'].sum() if not df_compras.empty else 0.0
+
+        col1, col2, col3 = st.columns(3)
+        col1.metric(f"Demanda Prevista ({horizonte} dias)", f"{df_plano['Previsão'].sum():,.0f} un")
+        col2.metric("Unidades a Produzir", f"{df_plano['Produzir'].sum():,}")
+        col3.metric("Compras Sugeridas", f"R$ {custo_compras:,.2f}")
+
+        st.divider()
+        c1, c2 = st.columns(2)
+        with c1:
+            st.markdown("##### 🍩 Sugestão de Produção")
+            st.dataframe(df_plano, use_container_width=True, hide_index=True,
+                         column_config={"Previsão": st.column_config.NumberColumn(format="%.1f")})
+        with c2:
+            st.markdown("##### 🛒 Sugestão de Compras")
+            if not df_compras.empty:
+                st.dataframe(df_compras, use_container_width=True, hide_index=True,
+                             column_config={
+                                 "Necessário": st.column_config.NumberColumn(format="%.2f"),
+                                 "Em Estoque": st.column_config.NumberColumn(format="%.2f"),
+                                 "Comprar": st.column_config.NumberColumn(format="%.2f"),
+                                 "Custo Estimado": st.column_config.NumberColumn(format="R$ %.2f")
+                             })
+            else:
+                st.info("Nenhum insumo necessário. Cadastre a Ficha Técnica na aba Produtos.")
+
+        fig3 = px.bar(df_plano, x='Produto', y=['Previsão', 'Estoque Pronto'], barmode='group',
+                      color_discrete_sequence=['#C62828', '#4ADE80'])
+        fig3.update_layout(paper_bgcolor='rgba(0,0,0,0)', plot_bgcolor='rgba(0,0,0,0)', font_color="white", yaxis_title="Unidades", legend_title="")
+        st.plotly_chart(fig3, use_container_width=True)
+
+    st.markdown("---")
+    with st.expander("🔄 Recalcular Previsão com Todo o Histórico"):
+        st.caption("Necessário apenas na primeira vez ou após editar vendas antigas. Depois disso a previsão se atualiza sozinha.")
+        if st.button("Recalcular Agora"):
+            qtd_prods = reconstruir_previsoes(df_pf['id'].tolist() if not df_pf.empty else [])
+            st.success(f"Previsão recalculada para {qtd_prods} produto(s)!")
+            st.rerun()